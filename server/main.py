@@ -1,14 +1,31 @@
+import io
 import os
+import csv
+import re
+import math
+import json
+import time
+import uuid
+import sqlite3
+import shutil
+import hashlib
+import random
 import asyncio
 import logging
-from typing import List, Optional
-from fastapi import FastAPI, BackgroundTasks, HTTPException, Request
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Set
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from pyrogram import Client
-from pyrogram.errors import FloodWait
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pyrogram import Client, raw
+from pyrogram.file_id import FileId, FileType, FileUniqueId, FileUniqueType, ThumbnailSource
+from pyrogram.errors import (
+    FloodWait, RPCError, FileReferenceExpired, MessageNotModified,
+    MediaEmpty, MediaInvalid, FileIdInvalid, DocumentInvalid,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,16 +42,257 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global State
+# Prometheus metrics, served at /metrics
+STAGE_SECONDS = Histogram(
+    "renamer_stage_seconds", "Time spent per pipeline stage", ["stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+FILES_TOTAL = Counter("renamer_files_total", "Files finished, by outcome", ["status"])
+BYTES_TOTAL = Counter("renamer_bytes_total", "Bytes of successfully renamed files")
+RETRIES_TOTAL = Counter("renamer_retries_total", "File attempts put back on the retry queue")
+FLOOD_WAITS_TOTAL = Counter("renamer_flood_waits_total", "FloodWait errors received from Telegram")
+FLOOD_WAIT_SECONDS = Counter("renamer_flood_wait_seconds_total", "Seconds Telegram asked us to wait")
+
+def count_flood_wait(seconds: float):
+    FLOOD_WAITS_TOTAL.inc()
+    FLOOD_WAIT_SECONDS.inc(seconds)
+
+class RateLimiter:
+    """Adaptive token bucket shared by every send and delete a job makes.
+
+    The refill rate creeps up while calls go through and is halved when
+    Telegram answers with a FloodWait, during which nobody gets a token.
+    """
+
+    def __init__(self, rate: float = 1.0, min_rate: float = 0.2, max_rate: float = 5.0,
+                 burst: int = 3, increase: float = 0.05):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.flood_waits = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # The lock makes waiters queue up in order instead of racing for tokens
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_flood_wait(self, seconds: float):
+        now = time.monotonic()
+        self.flood_waits += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.updated = self.paused_until
+
+class EventLog:
+    """Fixed-capacity ring buffer of ``(seq, kind, data)`` job events.
+
+    Appends are O(1) and overwrite the oldest slot once the ring is full.
+    Sequence numbers increase forever, so a client can ask for everything
+    after the last ``seq`` it saw and slot lookups are ``seq % capacity``.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.slots: List[Optional[tuple]] = [None] * capacity
+        self.seq = 0
+
+    @property
+    def first_seq(self) -> int:
+        # Oldest sequence number still in the ring
+        return max(1, self.seq - self.capacity + 1)
+
+    def append(self, kind: str, data: dict) -> int:
+        self.seq += 1
+        self.slots[self.seq % self.capacity] = (self.seq, kind, data)
+        return self.seq
+
+    def after(self, seq: int, kind: Optional[str] = None, limit: Optional[int] = None) -> List[tuple]:
+        entries = []
+        for n in range(max(seq + 1, self.first_seq), self.seq + 1):
+            entry = self.slots[n % self.capacity]
+            if kind is None or entry[1] == kind:
+                entries.append(entry)
+                if limit is not None and len(entries) >= limit:
+                    break
+        return entries
+
+    def tail(self, count: int, kind: Optional[str] = None) -> List[tuple]:
+        entries = []
+        for n in range(self.seq, self.first_seq - 1, -1):
+            entry = self.slots[n % self.capacity]
+            if kind is None or entry[1] == kind:
+                entries.append(entry)
+                if len(entries) >= count:
+                    break
+        entries.reverse()
+        return entries
+
 class TaskState:
-    is_running: bool = False
-    progress: int = 0
-    total: int = 0
-    current_file: str = ""
-    logs: List[str] = []
-    should_stop: bool = False
+    """Progress and controls of one renaming job."""
+
+    def __init__(self, job_id: str, account: str, limiter: RateLimiter):
+        self.job_id = job_id
+        # Hash of the Telegram account the job runs as
+        self.account = account
+        # "queued", "running", "completed", "stopped" or "error"
+        self.status = "queued"
+        self.is_running = False
+        self.progress = 0
+        self.total = 0
+        self.current_file = ""
+        self.should_stop = False
+        self.concurrency = 1
+        # worker number -> file that worker is currently renaming
+        self.workers: Dict[int, str] = {}
+        # Shared with every other job of the same account
+        self.limiter = limiter
+        self.succeeded = 0
+        self.failed = 0
+        # Attempts put back on the queue, and how many are waiting right now
+        self.retries = 0
+        self.retrying = 0
+        # Media messages found by the scan so far
+        self.scanned = 0
+        # Source messages deleted in move mode
+        self.deleted = 0
+        self.journal = JobJournal(job_id)
+        self.created = time.time()
+        # Log lines and per-file results, read by /api/logs and /api/events
+        self.events = EventLog(JOB_EVENT_CAPACITY)
+        # Replaced every time it fires, so waiters always see the next change
+        self.changed = asyncio.Event()
+        # Worker queue while the job runs, for the queue depth metric
+        self.queue: Optional[asyncio.Queue] = None
+
+    def add_log(self, message: str):
+        print(f"[{self.job_id[:8]}] {message}")
+        self.add_event("log", {"line": message})
+
+    def add_event(self, kind: str, data: dict):
+        self.events.append(kind, data)
+        self.notify()
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def snapshot(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "is_running": self.is_running,
+            "progress": self.progress,
+            "total": self.total,
+            "current_file": self.current_file,
+            "concurrency": self.concurrency,
+            "workers": dict(self.workers),
+            "send_rate": round(self.limiter.rate, 2),
+            "flood_waits": self.limiter.flood_waits,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "retrying": self.retrying,
+            "scanned": self.scanned,
+            "deleted": self.deleted,
+        }
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "is_running": self.is_running,
+            "progress": self.progress,
+            "total": self.total,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "created": self.created,
+        }
+
+# Events (log lines and file results) kept per job
+JOB_EVENT_CAPACITY = 2000
+
+# Upper bound for StartRequest.concurrency; Telegram starts answering
+# with FloodWait quickly once a single account has more sends in flight.
+MAX_CONCURRENCY = 8
+
+# Backoff between attempts at the same file, in seconds
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 300.0
+
+# The scan asks Telegram for document and video messages only, one window
+# of message ids at a time, SEARCH_PAGE results per call (Telegram's maximum)
+SEARCH_WINDOW = 5000
+SEARCH_PAGE = 100
+# Windows fetched concurrently, and the starting request rate of the
+# scan limiter every scan of an account shares
+SCAN_SHARDS = int(os.environ.get("SCAN_SHARDS", "4"))
+SCAN_RATE = 10.0
+
+# Mapping rows serialized per chunk of a streamed /api/plan response
+PLAN_CHUNK = 1000
+
+# On-disk index of the media messages already seen in each source channel,
+# and how many indexed ids are checked against Telegram per call
+INDEX_CHECK_BATCH = 100
+MEDIA_INDEX_PATH = os.environ.get("MEDIA_INDEX_PATH", "/tmp/media_index.sqlite3")
+
+# One JSON-lines journal per job, used to resume after a crash or restart
+JOURNAL_DIR = os.environ.get("JOURNAL_DIR", "/tmp/journals")
+
+# Temporary downloads of the reupload path, and the disk space they may use
+SPOOL_DIR = os.environ.get("SPOOL_DIR", "/tmp/downloads")
+SPOOL_MAX_BYTES = int(os.environ.get("SPOOL_MAX_BYTES", str(4 * 1024 ** 3)))
+
+# Downloaded files waiting for their upload may take at most this many bytes
+PREFETCH_BUFFER_BYTES = int(os.environ.get("PREFETCH_BUFFER_BYTES", str(2 * 1024 ** 3)))
 
-state = TaskState()
+# Streaming uploads: bytes per upload part (Telegram's maximum), parts
+# buffered between download and upload, and parallel part uploads
+STREAM_PART_SIZE = 512 * 1024
+STREAM_BUFFER_PARTS = 8
+STREAM_UPLOAD_WORKERS = 3
+
+# Most message ids Telegram accepts in one delete_messages call
+DELETE_BATCH = 100
+
+# Thumbnail bytes kept in memory for reuse across renames, retries and jobs
+THUMB_CACHE_BYTES = 16 * 1024 * 1024
+
+# Assumed download/upload throughput per worker for /api/plan estimates (bytes/s)
+ESTIMATED_TRANSFER_RATE = float(os.environ.get("ESTIMATED_TRANSFER_RATE", str(8 * 1024 ** 2)))
+
+# Pooled Telegram clients unused for this long are disconnected (seconds)
+CLIENT_IDLE_TIMEOUT = float(os.environ.get("CLIENT_IDLE_TIMEOUT", "900"))
+# A pooled client idle for longer than this is pinged before it is reused
+CLIENT_HEALTH_CHECK_AFTER = 60.0
+
+# Jobs allowed to run at once; further jobs wait in the scheduler queue
+MAX_RUNNING_JOBS = int(os.environ.get("MAX_RUNNING_JOBS", "2"))
+# Finished jobs kept in memory for /api/status and /api/jobs
+MAX_FINISHED_JOBS = 50
 
 class StartRequest(BaseModel):
     api_id: int
@@ -44,169 +302,1591 @@ class StartRequest(BaseModel):
     dest_chat_id: str
     filenames: List[str]
     start_index: int = 0
+    # "reupload" downloads and uploads the file again under the new name,
+    # "stream" pipes it from download to upload through memory without
+    # touching disk. "file_id" re-sends the stored document without moving
+    # any bytes and "edit" changes the source message in place; Telegram
+    # keeps the stored filename in both, so the new name is only the caption.
+    transfer_mode: str = "reupload"
+    # Path used when Telegram rejects a file_id as media: "reupload" or "stream"
+    fallback_mode: str = "reupload"
+    # Number of renames running at the same time
+    concurrency: int = 3
+    # Attempts per file before it is reported as failed
+    max_attempts: int = 5
+    # Message id window of the source scan (inclusive). filenames[0] maps
+    # to the first media message at or after min_message_id.
+    min_message_id: Optional[int] = None
+    max_message_id: Optional[int] = None
+    # Resume point: the scan jumps straight to this message id and its first
+    # media message gets filenames[start_index], so no earlier ids are fetched.
+    offset_id: Optional[int] = None
+    # Take channel messages already in the local media index from there
+    # (checked against Telegram in batches) and only search newer ones
+    use_index: bool = True
+    # "Move" instead of copy: delete each source message once its renamed
+    # copy has been sent
+    delete_originals: bool = False
+
+class MediaRecord:
+    """What a rename needs to know about a source media message."""
+    __slots__ = ("message_id", "file_id", "file_unique_id", "file_name",
+                 "file_size", "mime_type", "is_video", "thumb_file_id")
+
+    def __init__(self, message_id: int, file_id: str, file_unique_id: str, file_name: Optional[str],
+                 file_size: int, mime_type: Optional[str], is_video: bool, thumb_file_id: Optional[str]):
+        self.message_id = message_id
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.file_name = file_name
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.is_video = is_video
+        self.thumb_file_id = thumb_file_id
+
+    @classmethod
+    def from_message(cls, message) -> "MediaRecord":
+        media = message.video or message.document
+        thumb_file_id = None
+        if message.video and message.video.thumbs:
+            thumb_file_id = message.video.thumbs[0].file_id
+        return cls(message.id, media.file_id, media.file_unique_id, media.file_name,
+                   media.file_size or 0, media.mime_type, bool(message.video), thumb_file_id)
+
+    @classmethod
+    def from_raw(cls, message) -> Optional["MediaRecord"]:
+        """Build a record straight from a raw ``Message``, or None if it isn't a video or document.
+
+        Mirrors how Pyrogram tells videos from documents and encodes their
+        file ids, without parsing the sender, chat, entities and the rest.
+        """
+        if not isinstance(message, raw.types.Message) or not isinstance(message.media, raw.types.MessageMediaDocument):
+            return None
+        doc = message.media.document
+        if not isinstance(doc, raw.types.Document):
+            return None
+        attributes = {type(attribute): attribute for attribute in doc.attributes}
+        # Animations, stickers, video notes and audio are not renamed
+        if raw.types.DocumentAttributeAnimated in attributes or raw.types.DocumentAttributeSticker in attributes:
+            return None
+        video = attributes.get(raw.types.DocumentAttributeVideo)
+        if video is not None and video.round_message:
+            return None
+        if video is None and raw.types.DocumentAttributeAudio in attributes:
+            return None
+
+        file_name = getattr(attributes.get(raw.types.DocumentAttributeFilename), "file_name", None)
+        file_id = FileId(
+            file_type=FileType.VIDEO if video else FileType.DOCUMENT, dc_id=doc.dc_id,
+            media_id=doc.id, access_hash=doc.access_hash, file_reference=doc.file_reference
+        ).encode()
+        file_unique_id = FileUniqueId(file_unique_type=FileUniqueType.DOCUMENT, media_id=doc.id).encode()
+        thumb_file_id = None
+        # Same as Video.thumbs[0]: the first plain PhotoSize
+        thumb = next((t for t in doc.thumbs or [] if isinstance(t, raw.types.PhotoSize)), None)
+        if video and thumb:
+            thumb_file_id = FileId(
+                file_type=FileType.THUMBNAIL, dc_id=doc.dc_id, media_id=doc.id,
+                access_hash=doc.access_hash, file_reference=doc.file_reference,
+                thumbnail_file_type=FileType.THUMBNAIL, thumbnail_source=ThumbnailSource.THUMBNAIL,
+                thumbnail_size=thumb.type, volume_id=0, local_id=0
+            ).encode()
+        return cls(message.id, file_id, file_unique_id, file_name,
+                   doc.size or 0, doc.mime_type, video is not None, thumb_file_id)
+
+class MediaIndex:
+    """SQLite store of media messages per channel.
+
+    ``scanned_up_to`` is the highest message id up to which a chat's
+    history has been scanned without gaps, so later scans only have to
+    fetch messages after it. Only ``-100…`` chats are stored: their message
+    ids are the same for every account, unlike private chats and groups.
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS media (
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT NOT NULL,
+                file_name TEXT,
+                file_size INTEGER NOT NULL,
+                mime_type TEXT,
+                is_video INTEGER NOT NULL,
+                thumb_file_id TEXT,
+                PRIMARY KEY (chat_id, message_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS chats (
+                chat_id INTEGER PRIMARY KEY,
+                scanned_up_to INTEGER NOT NULL
+            );
+        """)
+
+    def scanned_up_to(self, chat_id: int) -> int:
+        row = self.db.execute("SELECT scanned_up_to FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row[0] if row else 0
+
+    def iter_media(self, chat_id: int, min_id: int, max_id: int, limit: int = -1):
+        cursor = self.db.execute(
+            "SELECT message_id, file_id, file_unique_id, file_name, file_size, mime_type, is_video, thumb_file_id "
+            "FROM media WHERE chat_id = ? AND message_id BETWEEN ? AND ? ORDER BY message_id LIMIT ?",
+            (chat_id, min_id, max_id, limit)
+        )
+        for row in cursor:
+            yield MediaRecord(*row[:6], bool(row[6]), row[7])
+
+    def add(self, chat_id: int, records: List[MediaRecord], scanned_from: int, scanned_to: int):
+        # Extend the gap-free range only if this batch continues it
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(chat_id, r.message_id, r.file_id, r.file_unique_id, r.file_name, r.file_size,
+                  r.mime_type, int(r.is_video), r.thumb_file_id) for r in records]
+            )
+            if scanned_from <= self.scanned_up_to(chat_id) + 1:
+                self.db.execute(
+                    "INSERT INTO chats VALUES (?, ?) ON CONFLICT(chat_id) "
+                    "DO UPDATE SET scanned_up_to = MAX(scanned_up_to, excluded.scanned_up_to)",
+                    (chat_id, scanned_to)
+                )
+
+    def remove(self, chat_id: int, message_ids: List[int]):
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM media WHERE chat_id = ? AND message_id = ?",
+                [(chat_id, message_id) for message_id in message_ids]
+            )
+
+    def update(self, chat_id: int, record: MediaRecord):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, record.message_id, record.file_id, record.file_unique_id, record.file_name,
+                 record.file_size, record.mime_type, int(record.is_video), record.thumb_file_id)
+            )
+
+media_index = MediaIndex(MEDIA_INDEX_PATH)
+
+class ResumeRequest(BaseModel):
+    job_id: str
+    # Credentials are never written to the journal, so resuming needs them again
+    api_id: int
+    api_hash: str
+    session_string: str
+
+# Columns of the per-file job report, in CSV order
+REPORT_FIELDS = ["index", "message_id", "original_name", "new_name", "bytes",
+                 "duration", "attempts", "status", "error"]
+
+class JobJournal:
+    """Append-only JSON-lines record of the files a job has finished.
+
+    The first line holds the job's request without its credentials; every
+    later line is the result of one file (see REPORT_FIELDS) or, in move
+    mode, the index a message was given before it was queued. Lines are
+    fsynced so a crash loses at most the renames that were in flight.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.path = os.path.join(JOURNAL_DIR, f"{job_id}.jsonl")
+
+    @staticmethod
+    def valid_id(job_id: str) -> bool:
+        return re.fullmatch(r"[0-9a-f]{32}", job_id) is not None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _append(self, entry: dict):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def create(self, req: StartRequest):
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        # model_dump on pydantic 2, dict on 1 (deprecated in 2)
+        dump = req.model_dump if hasattr(req, "model_dump") else req.dict
+        request = dump(exclude={"api_id", "api_hash", "session_string"})
+        self._append({"job_id": self.job_id, "created": time.time(), "request": request})
+
+    def record(self, result: dict):
+        self._append(result)
+
+    def plan(self, index: int, message_id: int):
+        self._append({"planned": index, "message_id": message_id})
+
+    def _entries(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A crash mid-write can leave a torn last line
+                    continue
+
+    def load(self):
+        """Return the stored request and a ``{index: message_id}`` map of finished files."""
+        request = None
+        done: Dict[int, int] = {}
+        for entry in self._entries():
+            if "request" in entry:
+                request = entry["request"]
+            elif "planned" in entry:
+                continue
+            elif entry.get("status", "ok") == "ok":
+                done[entry["index"]] = entry["message_id"]
+        return request, done
+
+    def planned(self) -> Dict[int, int]:
+        """Return the ``{message_id: index}`` assignments journaled by move-mode runs."""
+        return {entry["message_id"]: entry["planned"] for entry in self._entries() if "planned" in entry}
+
+    def results(self) -> List[dict]:
+        """Latest result per source message, in filename order.
+
+        A file that failed in one run and was renamed after a resume shows
+        up once, with its final outcome.
+        """
+        latest: Dict[int, dict] = {}
+        for entry in self._entries():
+            if "request" not in entry and "planned" not in entry:
+                latest[entry["message_id"]] = entry
+        return sorted(latest.values(), key=lambda entry: entry["index"])
+
+class RenameItem:
+    __slots__ = ("index", "media", "new_name", "attempts", "elapsed", "prefetch")
+
+    def __init__(self, index: int, media: MediaRecord, new_name: str):
+        self.index = index
+        self.media = media
+        self.new_name = new_name
+        self.attempts = 0
+        # Seconds spent working on this file over all attempts, backoff excluded
+        self.elapsed = 0.0
+        # Future with the path of the file downloaded ahead by the Prefetcher
+        self.prefetch: Optional[asyncio.Future] = None
+
+def download_path(work_dir: str, state: TaskState, media: MediaRecord, new_name: str) -> str:
+    # One directory per file: the upload keeps new_name as its file name
+    # and parallel renames or jobs never write to the same path.
+    return os.path.join(work_dir, f"{state.job_id[:8]}-{media.message_id}", new_name)
+
+def remove_download(file_path: str):
+    # Removes the file's own directory, including any partial download
+    shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+
+class ByteBudget:
+    """Semaphore counted in bytes.
+
+    A request bigger than the whole capacity is let through once nothing
+    else is held, so a single huge file cannot block the pipeline forever.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.used = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, size: int):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.used == 0 or self.used + size <= self.capacity)
+            self.used += size
+
+    async def release(self, size: int):
+        async with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+class DownloadSpool:
+    """Disk budget for everything downloaded under SPOOL_DIR.
+
+    Shared by all jobs: a download reserves its size first and waits while
+    the spool is full; the reservation is given back once the file has
+    been uploaded and deleted.
+    """
+
+    def __init__(self, directory: str, capacity: int):
+        self.directory = directory
+        self.capacity = capacity
+        self._budget: Optional[ByteBudget] = None
+
+    @property
+    def budget(self) -> ByteBudget:
+        # Created on first use so it binds to the server's event loop
+        if self._budget is None:
+            self._budget = ByteBudget(self.capacity)
+        return self._budget
+
+    @property
+    def used(self) -> int:
+        return self._budget.used if self._budget else 0
+
+    async def acquire(self, size: int):
+        await self.budget.acquire(size)
+
+    async def release(self, size: int):
+        await self.budget.release(size)
+
+    def sweep(self) -> int:
+        """Delete the download directories an earlier process left behind.
+
+        Only ``<job8>-<message_id>`` directories (see download_path) are
+        touched, so a SPOOL_DIR shared with the journals or the media
+        index is safe to sweep.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if re.fullmatch(r"[0-9a-f]{8}-\d+", name) and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+spool = DownloadSpool(SPOOL_DIR, SPOOL_MAX_BYTES)
+
+class ThumbnailCache:
+    """LRU cache of thumbnail bytes keyed by the thumbnail's file_id.
+
+    Thumbnails are handed out as in-memory files, so parallel renames never
+    share a path on disk and retries don't download them again.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        # Downloads in progress, so concurrent misses fetch a thumbnail once
+        self.loading: Dict[str, asyncio.Future] = {}
+
+    async def get(self, client: Client, file_id: str) -> io.BytesIO:
+        data = self.entries.get(file_id)
+        if data is not None:
+            self.entries.move_to_end(file_id)
+        elif file_id in self.loading:
+            data = await asyncio.shield(self.loading[file_id])
+        else:
+            future = self.loading[file_id] = asyncio.get_running_loop().create_future()
+            try:
+                downloaded = await client.download_media(file_id, in_memory=True)
+                data = bytes(downloaded.getbuffer())
+                future.set_result(data)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                # Mark the exception as retrieved when nobody else was waiting
+                future.exception()
+                raise
+            finally:
+                del self.loading[file_id]
+            self._put(file_id, data)
+
+        thumb = io.BytesIO(data)
+        thumb.name = "thumb.jpg"
+        return thumb
+
+    def _put(self, file_id: str, data: bytes):
+        self.entries[file_id] = data
+        self.size += len(data)
+        while self.size > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+thumbnails = ThumbnailCache(THUMB_CACHE_BYTES)
+
+class Prefetcher:
+    """Download stage of the re-upload pipeline.
+
+    Up to ``downloads`` files are downloaded at once, started in queue
+    order and ahead of the workers, so the next files come in while the
+    current ones go out. Downloaded files that are still waiting for their
+    upload are limited to ``capacity`` bytes, on top of the shared spool
+    budget.
+    """
+
+    def __init__(self, state: TaskState, client: Client, work_dir: str, capacity: int, downloads: int):
+        self.state = state
+        self.client = client
+        self.work_dir = work_dir
+        self.budget = ByteBudget(capacity)
+        self.slots = asyncio.Semaphore(downloads)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # message id -> (bytes reserved, download path)
+        self.files: Dict[int, tuple] = {}
+        self.fetches: Set[asyncio.Task] = set()
+        self.task = asyncio.create_task(self._run())
+
+    def add(self, item: RenameItem):
+        item.prefetch = asyncio.get_running_loop().create_future()
+        # take() clears item.prefetch, so the future travels with the item
+        self.queue.put_nowait((item, item.prefetch))
+
+    async def _run(self):
+        while True:
+            item, future = await self.queue.get()
+            await self.slots.acquire()
+            fetch = asyncio.create_task(self._fetch(item, future))
+            self.fetches.add(fetch)
+            fetch.add_done_callback(self.fetches.discard)
+
+    async def _fetch(self, item: RenameItem, future: asyncio.Future):
+        # Whatever happens, the item's future is resolved and its bytes are
+        # given back; a worker waiting in take() must never hang.
+        media = item.media
+        path = None
+        try:
+            target = download_path(self.work_dir, self.state, media, item.new_name)
+            await self.budget.acquire(media.file_size)
+            try:
+                await spool.acquire(media.file_size)
+            except BaseException:
+                await self.budget.release(media.file_size)
+                raise
+            self.files[media.message_id] = (media.file_size, target)
+            with STAGE_SECONDS.labels("download").time():
+                path = await self.client.download_media(media.file_id, file_name=target)
+        except Exception as e:
+            self.state.add_log(f"Prefetch of {item.new_name} failed ({e}), the worker will download it.")
+        finally:
+            self.slots.release()
+            if path is None:
+                await self.discard(item)
+            if not future.done():
+                future.set_result(path)
+
+    async def take(self, item: RenameItem) -> Optional[str]:
+        # Only the first attempt uses the prefetched file; retries download inline
+        if item.prefetch is None:
+            return None
+        future, item.prefetch = item.prefetch, None
+        return await future
+
+    async def release(self, item: RenameItem):
+        entry = self.files.pop(item.media.message_id, None)
+        if entry is not None:
+            await spool.release(entry[0])
+            await self.budget.release(entry[0])
+
+    async def discard(self, item: RenameItem):
+        entry = self.files.get(item.media.message_id)
+        if entry is not None:
+            remove_download(entry[1])
+        await self.release(item)
+
+    async def close(self):
+        self.task.cancel()
+        for fetch in self.fetches:
+            fetch.cancel()
+        await asyncio.gather(self.task, *self.fetches, return_exceptions=True)
+        # Files downloaded for items no worker got to, e.g. after a stop
+        for size, path in self.files.values():
+            remove_download(path)
+            await spool.release(size)
+        self.files.clear()
+
+async def send_by_file_id(state: TaskState, client: Client, dest_chat: int, media: MediaRecord, new_name: str):
+    # Re-send the document already stored on Telegram's servers.
+    # No bytes go through this container.
+    await state.limiter.acquire()
+    with STAGE_SECONDS.labels("send").time():
+        sent = await client.send_cached_media(
+            chat_id=dest_chat,
+            file_id=media.file_id,
+            caption=new_name
+        )
+    state.limiter.on_success()
+    return sent
+
+async def edit_in_place(state: TaskState, client: Client, source_chat: int, media: MediaRecord, new_name: str):
+    # One edit on the existing message: no new message, no delete, no transfer.
+    # Telegram keeps the stored document's attributes, so the name is the caption.
+    await state.limiter.acquire()
+    try:
+        with STAGE_SECONDS.labels("edit").time():
+            await client.edit_message_caption(source_chat, media.message_id, caption=new_name)
+    except MessageNotModified:
+        # Already carries this name, e.g. from an earlier run
+        pass
+    state.limiter.on_success()
+
+async def send_by_reupload(state: TaskState, client: Client, media: MediaRecord, dest_chat: int, new_name: str,
+                           work_dir: str, file_path: Optional[str] = None):
+    # A prefetched file belongs to the Prefetcher, which also cleans it up
+    target = None
+    try:
+        # 1. Download, unless the Prefetcher already did
+        if file_path is None:
+            await spool.acquire(media.file_size)
+            target = download_path(work_dir, state, media, new_name)
+            state.add_log(f"Downloading {new_name}...")
+            with STAGE_SECONDS.labels("download").time():
+                file_path = await client.download_media(media.file_id, file_name=target)
+
+        # 2. Upload
+        state.add_log(f"Uploading as {new_name}...")
+
+        # Get thumbnail if exists
+        thumb = None
+        if media.thumb_file_id:
+            thumb = await thumbnails.get(client, media.thumb_file_id)
+
+        await state.limiter.acquire()
+        with STAGE_SECONDS.labels("upload").time():
+            sent = await client.send_document(
+                chat_id=dest_chat,
+                document=file_path,
+                caption=new_name,
+                thumb=thumb,
+                force_document=True
+            )
+        state.limiter.on_success()
+        return sent
+    finally:
+        # 3. Cleanup
+        if target is not None:
+            remove_download(target)
+            await spool.release(media.file_size)
+
+async def send_by_stream(state: TaskState, client: Client, media: MediaRecord, dest_chat: int, new_name: str):
+    """Pipe a file from Telegram back to Telegram through a bounded memory buffer.
+
+    Chunks from stream_media are cut into upload parts and uploaded while
+    the download continues; nothing is written to disk.
+    """
+    file_size = media.file_size
+    total_parts = max(1, math.ceil(file_size / STREAM_PART_SIZE))
+    # Telegram wants files over 10 MB uploaded as "big" files
+    is_big = file_size > 10 * 1024 * 1024
+    upload_id = client.rnd_id()
+    md5 = hashlib.md5()
+    parts: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER_PARTS)
+
+    async def produce():
+        index = 0
+        pending = bytearray()
+        async for chunk in client.stream_media(media.file_id):
+            pending += chunk
+            while len(pending) >= STREAM_PART_SIZE:
+                await parts.put((index, bytes(pending[:STREAM_PART_SIZE])))
+                del pending[:STREAM_PART_SIZE]
+                index += 1
+        if pending or index == 0:
+            await parts.put((index, bytes(pending)))
+        for _ in range(STREAM_UPLOAD_WORKERS):
+            await parts.put(None)
+
+    async def upload():
+        while True:
+            part = await parts.get()
+            if part is None:
+                return
+            index, data = part
+            if is_big:
+                await client.invoke(raw.functions.upload.SaveBigFilePart(
+                    file_id=upload_id, file_part=index, file_total_parts=total_parts, bytes=data
+                ))
+            else:
+                # Small files are uploaded by a single worker, so parts arrive in order
+                md5.update(data)
+                await client.invoke(raw.functions.upload.SaveFilePart(
+                    file_id=upload_id, file_part=index, bytes=data
+                ))
+
+    state.add_log(f"Streaming {new_name}...")
+    uploaders = STREAM_UPLOAD_WORKERS if is_big else 1
+    tasks = [asyncio.create_task(produce())] + [asyncio.create_task(upload()) for _ in range(uploaders)]
+    try:
+        with STAGE_SECONDS.labels("stream").time():
+            await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if is_big:
+        input_file = raw.types.InputFileBig(id=upload_id, parts=total_parts, name=new_name)
+    else:
+        input_file = raw.types.InputFile(id=upload_id, parts=total_parts, name=new_name, md5_checksum=md5.hexdigest())
+
+    thumb = None
+    if media.thumb_file_id:
+        thumb = await client.save_file(await thumbnails.get(client, media.thumb_file_id))
+
+    await state.limiter.acquire()
+    with STAGE_SECONDS.labels("send").time():
+        sent = await client.invoke(raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(dest_chat),
+            media=raw.types.InputMediaUploadedDocument(
+                mime_type=media.mime_type or "application/octet-stream",
+                file=input_file,
+                thumb=thumb,
+                attributes=[raw.types.DocumentAttributeFilename(file_name=new_name)],
+                force_file=True
+            ),
+            message=new_name,
+            random_id=client.rnd_id()
+        ))
+    state.limiter.on_success()
+    return sent
 
-def add_log(message: str):
-    print(message)
-    state.logs.append(message)
-    # Keep logs manageable
-    if len(state.logs) > 1000:
-        state.logs = state.logs[-1000:]
+async def refresh_media(client: Client, source_chat: int, media: MediaRecord) -> MediaRecord:
+    # file_ids from the index carry a file reference that Telegram expires
+    # after a while; fetch the message again to get a fresh one.
+    message = await client.get_messages(source_chat, media.message_id)
+    if message.empty or not (message.video or message.document):
+        raise ValueError(f"message {media.message_id} no longer has media")
+    fresh = MediaRecord.from_message(message)
+    media_index.update(source_chat, fresh)
+    return fresh
 
-async def run_renaming_task(req: StartRequest):
+async def rename_message(state: TaskState, client: Client, source_chat: int, media: MediaRecord, dest_chat: int,
+                         new_name: str, req: StartRequest, work_dir: str, file_path: Optional[str] = None,
+                         refreshed: bool = False):
+    try:
+        if req.transfer_mode == "edit":
+            return await edit_in_place(state, client, source_chat, media, new_name)
+        if req.transfer_mode == "file_id":
+            try:
+                return await send_by_file_id(state, client, dest_chat, media, new_name)
+            # Only rejections of the media itself; permission and peer errors
+            # would fail the fallback's upload just the same. ValueError is
+            # a file_id that doesn't decode.
+            except (MediaEmpty, MediaInvalid, FileIdInvalid, DocumentInvalid, ValueError) as e:
+                state.add_log(f"Telegram refused file_id re-send for {new_name} ({e}), falling back to {req.fallback_mode}.")
+            if req.fallback_mode == "stream":
+                return await send_by_stream(state, client, media, dest_chat, new_name)
+        elif req.transfer_mode == "stream":
+            return await send_by_stream(state, client, media, dest_chat, new_name)
+        return await send_by_reupload(state, client, media, dest_chat, new_name, work_dir, file_path)
+    except FileReferenceExpired:
+        if refreshed:
+            raise
+        state.add_log(f"File reference of {new_name} expired, refreshing message {media.message_id}.")
+        media = await refresh_media(client, source_chat, media)
+        return await rename_message(state, client, source_chat, media, dest_chat, new_name, req, work_dir, refreshed=True)
+
+def resolve_new_name(original_name: str, new_name: str) -> str:
+    # Keep the original extension when the target name has none
+    if "." not in new_name:
+        ext = os.path.splitext(original_name)[1]
+        if not ext:
+            ext = ".mkv" # Default
+        new_name += ext
+    return new_name
+
+def retry_delay(attempts: int) -> float:
+    # Exponential backoff with "equal jitter": half fixed, half random
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+async def requeue_later(state: TaskState, queue: asyncio.Queue, item: RenameItem, delay: float):
+    # The original entry is only marked done once the retry is queued,
+    # so queue.join() cannot return while a retry is still pending.
+    try:
+        # Sleep in short steps so a stop request doesn't wait out the backoff
+        deadline = time.monotonic() + delay
+        while not state.should_stop and time.monotonic() < deadline:
+            await asyncio.sleep(min(1.0, deadline - time.monotonic()))
+        if not state.should_stop:
+            await queue.put(item)
+    finally:
+        state.retrying -= 1
+        queue.task_done()
+
+class DeleteBatcher:
+    """Deletes renamed source messages in batches of up to DELETE_BATCH ids.
+
+    Every delete_messages call takes a token from the job's rate limiter,
+    like a send does.
+    """
+
+    def __init__(self, state: TaskState, client: Client, chat_id: int):
+        self.state = state
+        self.client = client
+        self.chat_id = chat_id
+        self.pending: List[int] = []
+        # One flush at a time, so no id is sent twice
+        self._lock = asyncio.Lock()
+
+    async def add(self, message_id: int):
+        self.pending.append(message_id)
+        if len(self.pending) >= DELETE_BATCH and not self._lock.locked():
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            while self.pending:
+                batch = self.pending[:DELETE_BATCH]
+                await self.state.limiter.acquire()
+                try:
+                    with STAGE_SECONDS.labels("delete").time():
+                        await self.client.delete_messages(self.chat_id, batch)
+                except FloodWait as e:
+                    # Keep the batch; the limiter makes the next try wait
+                    self.state.limiter.on_flood_wait(e.value)
+                    count_flood_wait(e.value)
+                    self.state.add_log(f"FloodWait while deleting originals: Pausing for {e.value} seconds...")
+                    continue
+                except RPCError as e:
+                    self.state.add_log(f"Could not delete {len(batch)} original messages: {e}")
+                else:
+                    self.state.limiter.on_success()
+                    self.state.deleted += len(batch)
+                    media_index.remove(self.chat_id, batch)
+                    self.state.add_log(f"Deleted {len(batch)} original messages.")
+                del self.pending[:len(batch)]
+
+def record_result(state: TaskState, item: RenameItem, original_name: str, status: str,
+                  error: Optional[Exception] = None):
+    result = {
+        "index": item.index,
+        "message_id": item.media.message_id,
+        "original_name": original_name,
+        "new_name": item.new_name,
+        "bytes": item.media.file_size,
+        "duration": round(item.elapsed, 3),
+        "attempts": item.attempts,
+        "status": status,
+        "error": str(error) if error else None,
+    }
+    state.journal.record(result)
+    state.add_event("file", result)
+    FILES_TOTAL.labels(status).inc()
+    if status == "ok":
+        BYTES_TOTAL.inc(item.media.file_size)
+
+async def rename_worker(state: TaskState, worker_id: int, client: Client, queue: asyncio.Queue, source_chat: int,
+                        dest_chat: int, req: StartRequest, work_dir: str, count: int,
+                        prefetcher: Optional[Prefetcher], deleter: Optional[DeleteBatcher]):
+    while True:
+        item = await queue.get()
+        if state.should_stop:
+            if prefetcher:
+                await prefetcher.discard(item)
+            queue.task_done()
+            continue
+
+        original_name = item.media.file_name or "unknown.mkv"
+        new_name = item.new_name
+        item.attempts += 1
+
+        state.current_file = f"{original_name} -> {new_name}"
+        state.workers[worker_id] = state.current_file
+        attempt_note = f" (attempt {item.attempts}/{req.max_attempts})" if item.attempts > 1 else ""
+        state.add_log(f"[W{worker_id}] Processing [{item.index+1}/{count}]{attempt_note}: {original_name} -> {new_name}")
+
+        error = None
+        started = time.monotonic()
+        try:
+            file_path = await prefetcher.take(item) if prefetcher else None
+            await rename_message(state, client, source_chat, item.media, dest_chat, new_name, req, work_dir, file_path)
+        except FloodWait as e:
+            # The limiter holds back every worker until the wait is over
+            state.limiter.on_flood_wait(e.value)
+            count_flood_wait(e.value)
+            state.add_log(f"FloodWait: Pausing for {e.value} seconds, send rate lowered to {state.limiter.rate:.2f}/s")
+            error = e
+        except Exception as e:
+            state.add_log(f"[W{worker_id}] Error processing {new_name}: {e}")
+            error = e
+        finally:
+            item.elapsed += time.monotonic() - started
+            state.workers.pop(worker_id, None)
+            if prefetcher:
+                await prefetcher.discard(item)
+
+        if error is None:
+            state.succeeded += 1
+            state.progress += 1
+            record_result(state, item, original_name, "ok")
+            state.add_log(f"[W{worker_id}] Successfully processed: {new_name}")
+            queue.task_done()
+            if deleter:
+                await deleter.add(item.media.message_id)
+        elif item.attempts < req.max_attempts:
+            delay = retry_delay(item.attempts)
+            state.retries += 1
+            state.retrying += 1
+            RETRIES_TOTAL.inc()
+            state.add_log(f"[W{worker_id}] Retrying {new_name} in {delay:.0f}s.")
+            asyncio.create_task(requeue_later(state, queue, item, delay))
+        else:
+            state.failed += 1
+            state.progress += 1
+            record_result(state, item, original_name, "failed", error)
+            state.add_log(f"[W{worker_id}] Giving up on {new_name} after {item.attempts} attempts.")
+            queue.task_done()
+
+async def latest_message_id(client: Client, chat_id: int) -> int:
+    async for message in client.get_chat_history(chat_id, limit=1):
+        return message.id
+    return 0
+
+async def invoke_scan(state: TaskState, client: Client, query):
+    """Run one history read under the account's scan limiter, waiting out FloodWaits."""
+    limiter = jobs.scan_limiter(state.account)
+    while True:
+        await limiter.acquire()
+        try:
+            with STAGE_SECONDS.labels("scan").time():
+                result = await client.invoke(query)
+        except FloodWait as e:
+            # Pauses every scan of the account; the same call is made again
+            count_flood_wait(e.value)
+            limiter.on_flood_wait(e.value)
+            state.add_log(f"FloodWait while scanning: Pausing for {e.value} seconds...")
+            continue
+        limiter.on_success()
+        return result
+
+async def search_media(state: TaskState, client: Client, peer, first_id: int, last_id: int) -> List[MediaRecord]:
+    """Media messages with ids in ``[first_id, last_id]``, oldest first.
+
+    The document and video search filters run on Telegram's side, so text,
+    photos and service messages never cross the wire.
+    """
+    found: Dict[int, MediaRecord] = {}
+    for media_filter in (raw.types.InputMessagesFilterDocument, raw.types.InputMessagesFilterVideo):
+        offset_id = 0
+        while True:
+            # min_id and max_id are exclusive; pages go newest first
+            r = await invoke_scan(state, client, raw.functions.messages.Search(
+                peer=peer, q="", filter=media_filter(), min_date=0, max_date=0,
+                offset_id=offset_id, add_offset=0, limit=SEARCH_PAGE,
+                max_id=last_id + 1, min_id=first_id - 1, hash=0
+            ))
+            # Raw messages go straight to records; users, chats and
+            # entities in the reply are never parsed
+            for message in r.messages:
+                record = MediaRecord.from_raw(message)
+                if record:
+                    found[record.message_id] = record
+            if len(r.messages) < SEARCH_PAGE:
+                break
+            offset_id = min(message.id for message in r.messages)
+    return [found[message_id] for message_id in sorted(found)]
+
+async def check_indexed(state: TaskState, client: Client, chat_id: int, records: List[MediaRecord]) -> List[MediaRecord]:
+    """The indexed records whose messages still have media, with fresh file references.
+
+    Messages deleted outside this app would otherwise keep their place in
+    the numbering and shift every later filename. Missing ones are dropped
+    from the index as well.
+    """
+    peer = await client.resolve_peer(chat_id)
+    r = await invoke_scan(state, client, raw.functions.channels.GetMessages(
+        channel=raw.types.InputChannel(channel_id=peer.channel_id, access_hash=peer.access_hash),
+        id=[raw.types.InputMessageID(id=record.message_id) for record in records]
+    ))
+    fresh: Dict[int, MediaRecord] = {}
+    for message in r.messages:
+        record = MediaRecord.from_raw(message)
+        if record:
+            fresh[record.message_id] = record
+    gone = [record.message_id for record in records if record.message_id not in fresh]
+    if gone:
+        state.add_log(f"{len(gone)} indexed messages no longer exist, removing them from the media index.")
+        media_index.remove(chat_id, gone)
+    return [fresh[record.message_id] for record in records if record.message_id in fresh]
+
+async def iter_media_batches(state: TaskState, client: Client, chat_id: int, min_id: int, max_id: int):
+    """Yield ``(first_id, last_id, records)`` for consecutive id windows, oldest first.
+
+    Up to SCAN_SHARDS windows are fetched at once under the account's scan
+    limiter, so a FloodWait slows every scan of that account. Each window
+    is yielded as soon as it and every window before it is done, so the
+    first match still arrives after the first window.
+    """
+    peer = await client.resolve_peer(chat_id)
+    pending = deque()
+    start = max(min_id, 1)
+    try:
+        while pending or start <= max_id:
+            while len(pending) < SCAN_SHARDS and start <= max_id:
+                end = min(start + SEARCH_WINDOW - 1, max_id)
+                task = asyncio.ensure_future(search_media(state, client, peer, start, end))
+                pending.append((start, end, task))
+                start = end + 1
+            first_id, last_id, task = pending.popleft()
+            yield first_id, last_id, await task
+    finally:
+        # The consumer stopped early (stop, end of filenames) or a window failed
+        for _, _, task in pending:
+            task.cancel()
+
+async def iter_media(state: TaskState, client: Client, chat_id: int, min_id: int = 1, max_id: Optional[int] = None,
+                     use_index: bool = True):
+    """Yield the media records of a chat between two message ids, oldest first.
+
+    The part of the range already in the media index is read from disk;
+    the rest is scanned from Telegram and added to the index on the way.
+    """
+    if max_id is None:
+        max_id = await latest_message_id(client, chat_id)
+
+    # Only channel and supergroup message ids are the same for every
+    # account; in other chats each account numbers messages itself
+    indexable = str(chat_id).startswith("-100")
+    scan_from = max(min_id, 1)
+    if use_index and indexable:
+        indexed_to = min(media_index.scanned_up_to(chat_id), max_id)
+        if scan_from <= indexed_to:
+            state.add_log(f"Reading messages {scan_from}-{indexed_to} from the media index.")
+            while scan_from <= indexed_to:
+                records = list(media_index.iter_media(chat_id, scan_from, indexed_to, INDEX_CHECK_BATCH))
+                if not records:
+                    break
+                for record in await check_indexed(state, client, chat_id, records):
+                    yield record
+                scan_from = records[-1].message_id + 1
+            scan_from = indexed_to + 1
+
+    async for first_id, last_id, records in iter_media_batches(state, client, chat_id, scan_from, max_id):
+        if indexable:
+            media_index.add(chat_id, records, first_id, last_id)
+        for record in records:
+            yield record
+
+async def iter_mapping(state: TaskState, client: Client, source_chat: int, req: StartRequest,
+                       planned: Optional[Dict[int, int]] = None):
+    """Yield ``(index, media, new_name)`` for the media messages in the job's window.
+
+    This is the one place that decides which message gets which filename,
+    shared by real runs and /api/plan. ``new_name`` is None for media
+    beyond the end of ``req.filenames``; callers decide whether to stop.
+
+    ``planned`` maps message ids to the indices an earlier move-mode run
+    gave them. Originals it already deleted are missing from the scan, so
+    counting media would shift every later filename; messages up to the
+    last planned one keep their journaled index and numbering resumes
+    after it.
+    """
+    scan_from = req.min_message_id or 1
+    index = 0
+    # Without an offset_id the first start_index media messages are
+    # scanned and skipped; with one, scanning begins at the resume point.
+    skip = req.start_index
+    if req.offset_id:
+        scan_from = max(scan_from, req.offset_id)
+        index = req.start_index
+        skip = 0
+    planned = planned or {}
+    last_planned = max(planned, default=0)
+    if planned:
+        index = max(planned.values()) + 1
+        skip = 0
+    state.add_log(f"Scanning messages in {source_chat} from id {scan_from} (oldest first)...")
+
+    async for media in iter_media(state, client, source_chat, scan_from, req.max_message_id, req.use_index):
+        if media.message_id <= last_planned:
+            # Not planned before the last planned message: skipped by start_index
+            if media.message_id not in planned:
+                continue
+            number = planned[media.message_id]
+        elif skip:
+            skip -= 1
+            index += 1
+            continue
+        else:
+            number = index
+            index += 1
+        new_name = None
+        if number < len(req.filenames):
+            new_name = resolve_new_name(media.file_name or "unknown.mkv", req.filenames[number])
+        yield number, media, new_name
+
+async def run_renaming_task(state: TaskState, req: StartRequest, done: Optional[Set[int]] = None):
+    # done: message ids a previous run of this job already renamed
+    done = done or set()
     state.is_running = True
-    state.should_stop = False
-    state.progress = 0
+    state.status = "running"
     state.total = len(req.filenames)
-    state.logs = []
     
-    add_log("Starting renaming task...")
+    state.add_log(f"Starting renaming task {state.job_id}...")
     
-    # Create working directory for downloads
     # Use /tmp for ephemeral storage on Render/cloud envs
-    work_dir = "/tmp/downloads"
-    if not os.path.exists(work_dir):
-        os.makedirs(work_dir)
-
-    client = Client(
-        "renamer_session",
-        api_id=req.api_id,
-        api_hash=req.api_hash,
-        session_string=req.session_string,
-        in_memory=True
-    )
+    work_dir = spool.directory
+    os.makedirs(work_dir, exist_ok=True)
 
+    client = None
     try:
-        await client.start()
-        add_log("Connected to Telegram successfully.")
+        started = time.monotonic()
+        client = await clients.acquire(state.account, req)
+        state.add_log(f"Connected to Telegram successfully ({(time.monotonic() - started) * 1000:.0f} ms).")
 
         try:
             source_chat = int(req.source_chat_id)
             dest_chat = int(req.dest_chat_id)
         except ValueError:
-            add_log("Error: Chat IDs must be integers (e.g., -100123456789).")
+            state.add_log("Error: Chat IDs must be integers (e.g., -100123456789).")
+            state.status = "error"
             return
 
-        add_log(f"Fetching messages from {source_chat}...")
-        
-        messages = []
-        async for message in client.get_chat_history(source_chat):
-            if state.should_stop:
-                add_log("Task stopped by user.")
-                break
-            if message.video or message.document:
-                messages.append(message)
-        
-        # Sort messages by ID (oldest first usually)
-        messages.sort(key=lambda x: x.id)
-        
-        add_log(f"Found {len(messages)} media files in source channel.")
-        add_log(f"Target filenames provided: {len(req.filenames)}")
-
-        count = min(len(messages), len(req.filenames))
-        
-        # Adjust start index
+        count = len(req.filenames)
         start_idx = req.start_index
         if start_idx >= count:
-             add_log("Start index is greater than available files. Finished.")
+             state.add_log("Start index is greater than available files. Finished.")
+             state.status = "completed"
              return
 
-        for i in range(start_idx, count):
-            if state.should_stop:
-                add_log("Task stopped by user.")
-                break
+        # Workers start right away and pick up files while the scan continues.
+        # The bounded queue keeps the scan only slightly ahead of them.
+        queue: asyncio.Queue = asyncio.Queue(maxsize=req.concurrency * 2)
+        state.queue = queue
+        state.progress = start_idx
+        state.concurrency = req.concurrency
+        state.add_log(f"Starting {state.concurrency} rename workers.")
 
-            state.progress = i + 1
-            msg = messages[i]
-            new_name = req.filenames[i]
-            
-            # Helper to get file extension
-            original_media = msg.video or msg.document
-            original_name = original_media.file_name or "unknown.mkv"
-            
-            if "." not in new_name:
-                ext = os.path.splitext(original_name)[1]
-                if not ext:
-                    ext = ".mkv" # Default
-                new_name += ext
-
-            state.current_file = f"{original_name} -> {new_name}"
-            add_log(f"Processing [{i+1}/{count}]: {original_name} -> {new_name}")
+        # In reupload mode every file goes through disk, so download the
+        # next files while the workers upload the current ones.
+        prefetcher = None
+        if req.transfer_mode == "reupload":
+            prefetcher = Prefetcher(state, client, work_dir, PREFETCH_BUFFER_BYTES, req.concurrency)
 
-            try:
-                # 1. Download
-                add_log(f"Downloading {original_name}...")
-                file_path = await client.download_media(msg, file_name=os.path.join(work_dir, new_name))
-                
-                # 2. Upload
-                add_log(f"Uploading as {new_name}...")
-                
-                # Get thumbnail if exists
-                thumb_path = None
-                if msg.video and msg.video.thumbs:
-                    thumb_path = await client.download_media(msg.video.thumbs[0].file_id, file_name=os.path.join(work_dir, "thumb.jpg"))
-
-                await client.send_document(
-                    chat_id=dest_chat,
-                    document=file_path,
-                    caption=new_name,
-                    thumb=thumb_path,
-                    force_document=True
-                )
+        # Move mode: originals are collected and deleted in batches, and
+        # each message's index is journaled before it can be deleted
+        deleter = None
+        planned = None
+        if req.delete_originals:
+            deleter = DeleteBatcher(state, client, source_chat)
+            planned = state.journal.planned()
 
-                # 3. Cleanup
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                if thumb_path and os.path.exists(thumb_path):
-                    os.remove(thumb_path)
+        workers = [
+            asyncio.create_task(rename_worker(state, n + 1, client, queue, source_chat, dest_chat, req, work_dir,
+                                              count, prefetcher, deleter))
+            for n in range(state.concurrency)
+        ]
+        try:
+            async for index, media, new_name in iter_mapping(state, client, source_chat, req, planned):
+                if state.should_stop:
+                    break
+                if new_name is None:
+                    # Past the last filename. After deleted originals the
+                    # count check below can be skipped, so stop here too.
+                    state.scanned = count
+                    break
+                state.scanned = index + 1
+                if media.message_id in done:
+                    state.progress += 1
+                    # Renamed before a crash but maybe not deleted yet
+                    if deleter:
+                        await deleter.add(media.message_id)
+                else:
+                    if deleter and media.message_id not in planned:
+                        state.journal.plan(index, media.message_id)
+                    item = RenameItem(index, media, new_name)
+                    if prefetcher:
+                        prefetcher.add(item)
+                    await queue.put(item)
+                if state.scanned >= count:
+                    break
 
-                add_log(f"Successfully processed: {new_name}")
+            state.add_log(f"Scan finished: {state.scanned} media files matched in source channel.")
+            state.add_log(f"Target filenames provided: {count}")
+            if state.scanned < count and not state.should_stop:
+                state.add_log(f"Only {state.scanned} media files for {count} filenames; the extra names are unused.")
+                state.total = state.scanned
 
-            except FloodWait as e:
-                add_log(f"FloodWait: Sleeping for {e.value} seconds...")
-                await asyncio.sleep(e.value)
-                # Retry logic could be added here, but for now we skip or simple continue
-            except Exception as e:
-                add_log(f"Error processing {new_name}: {e}")
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if prefetcher:
+                await prefetcher.close()
+            # Also after a stop: these files were already sent
+            if deleter:
+                await deleter.flush()
 
-            # Brief pause
-            await asyncio.sleep(2)
+        state.add_log(f"Renamed {state.succeeded} files, {state.failed} failed, {state.retries} retries.")
+        if state.should_stop:
+            state.add_log("Task stopped by user.")
+            state.status = "stopped"
+            return
 
-        add_log("Task completed.")
+        state.add_log("Task completed.")
+        state.status = "completed"
 
     except Exception as e:
-        add_log(f"Critical Error: {e}")
+        state.add_log(f"Critical Error: {e}")
+        state.status = "error"
     finally:
         state.is_running = False
-        if client.is_connected:
-            await client.stop()
+        state.notify()
+        if client is not None:
+            clients.release(state.account)
+
+def account_key(req: StartRequest) -> str:
+    return hashlib.sha256(f"{req.api_id}:{req.session_string}".encode()).hexdigest()
+
+class PooledClient:
+    __slots__ = ("client", "users", "last_used", "lock")
+
+    def __init__(self, client: Client):
+        self.client = client
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+class ClientPool:
+    """Long-lived Pyrogram clients keyed by account, shared between jobs.
+
+    Keeping the connection open saves the connect, auth key exchange and
+    DC migration on every job. Clients nobody has used for
+    CLIENT_IDLE_TIMEOUT seconds are stopped by a background reaper.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, PooledClient] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def acquire(self, key: str, req: StartRequest) -> Client:
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap())
+
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = PooledClient(Client(
+                f"renamer_{key[:16]}",
+                api_id=req.api_id,
+                api_hash=req.api_hash,
+                session_string=req.session_string,
+                in_memory=True
+            ))
+
+        # Reserve the entry before awaiting so the reaper leaves it alone
+        entry.users += 1
+        try:
+            async with entry.lock:
+                # Never reconnect a client other jobs are still using
+                if entry.users == 1 and entry.client.is_connected and not await self._healthy(entry):
+                    logger.warning(f"Pooled client {key[:8]} failed its health check, reconnecting.")
+                    await self._stop(entry)
+                if not entry.client.is_connected:
+                    await entry.client.start()
+        except BaseException:
+            entry.users -= 1
+            # The entry was built from this request's credentials; drop it so
+            # a typo in api_hash doesn't block the account until it is reaped
+            if entry.users == 0 and not entry.client.is_connected and self.entries.get(key) is entry:
+                del self.entries[key]
+            raise
+        entry.last_used = time.monotonic()
+        return entry.client
+
+    def release(self, key: str):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+
+    async def _healthy(self, entry: PooledClient) -> bool:
+        if time.monotonic() - entry.last_used < CLIENT_HEALTH_CHECK_AFTER:
+            return True
+        try:
+            await asyncio.wait_for(entry.client.get_me(), timeout=10)
+            return True
+        except FloodWait:
+            return True
+        except Exception:
+            return False
+
+    async def _stop(self, entry: PooledClient):
+        try:
+            await entry.client.stop()
+        except Exception as e:
+            logger.warning(f"Error stopping pooled client: {e}")
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(60)
+            now = time.monotonic()
+            for key, entry in list(self.entries.items()):
+                if entry.users == 0 and now - entry.last_used > CLIENT_IDLE_TIMEOUT:
+                    del self.entries[key]
+                    if entry.client.is_connected:
+                        await self._stop(entry)
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        for entry in self.entries.values():
+            if entry.client.is_connected:
+                await self._stop(entry)
+        self.entries.clear()
+
+clients = ClientPool()
+
+class JobManager:
+    """Queues jobs and runs up to ``max_running`` of them at once.
+
+    Jobs of the same Telegram account share one RateLimiter. Its lock hands
+    out tokens in arrival order, so concurrent jobs on one account split
+    the account's send rate between them. History scans, including the
+    ones behind /api/plan, share a second, faster limiter per account.
+    """
+
+    def __init__(self, max_running: int):
+        self.max_running = max_running
+        self.jobs: Dict[str, TaskState] = {}
+        self.pending: deque = deque()
+        self.running = 0
+        self.limiters: Dict[str, RateLimiter] = {}
+        self.scan_limiters: Dict[str, RateLimiter] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def get(self, job_id: Optional[str]) -> TaskState:
+        # Without an id, fall back to the most recently submitted job
+        if job_id is None:
+            if not self.jobs:
+                raise HTTPException(status_code=404, detail="No jobs yet")
+            return next(reversed(self.jobs.values()))
+        if job_id not in self.jobs:
+            raise HTTPException(status_code=404, detail="Unknown job id")
+        return self.jobs[job_id]
+
+    def scan_limiter(self, account: str) -> RateLimiter:
+        if account not in self.scan_limiters:
+            self.scan_limiters[account] = RateLimiter(rate=SCAN_RATE, max_rate=SCAN_RATE * 3, burst=SCAN_SHARDS)
+        return self.scan_limiters[account]
+
+    def is_active(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        return job is not None and job.status in ("queued", "running")
+
+    def submit(self, job_id: str, req: StartRequest, done: Optional[Set[int]] = None) -> TaskState:
+        account = account_key(req)
+        if account not in self.limiters:
+            self.limiters[account] = RateLimiter()
+        state = TaskState(job_id, account, self.limiters[account])
+        state.add_log(f"Job queued ({self.running} running, {len(self.pending)} waiting).")
+        # A resumed job replaces its old entry and moves to the end
+        self.jobs.pop(job_id, None)
+        self.jobs[job_id] = state
+        self.pending.append((state, req, done))
+        self._evict_finished()
+        self._dispatch()
+        return state
+
+    def _dispatch(self):
+        while self.running < self.max_running and self.pending:
+            state, req, done = self.pending.popleft()
+            if state.should_stop:
+                state.status = "stopped"
+                continue
+            self.running += 1
+            task = asyncio.create_task(self._run(state, req, done))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, state: TaskState, req: StartRequest, done: Optional[Set[int]]):
+        try:
+            await run_renaming_task(state, req, done)
+        finally:
+            self.running -= 1
+            self._dispatch()
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status not in ("queued", "running")]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+jobs = JobManager(MAX_RUNNING_JOBS)
+
+Gauge("renamer_active_jobs", "Jobs currently running").set_function(lambda: jobs.running)
+Gauge("renamer_queued_jobs", "Jobs waiting for a free slot").set_function(lambda: len(jobs.pending))
+Gauge("renamer_queue_depth", "Files waiting in the worker queues of running jobs").set_function(
+    lambda: sum(job.queue.qsize() for job in jobs.jobs.values() if job.queue is not None and job.is_running)
+)
+
+@app.on_event("startup")
+async def sweep_spool():
+    # No job survives a restart, so anything left in the spool is orphaned
+    removed = spool.sweep()
+    if removed:
+        logger.info(f"Removed {removed} orphaned downloads from {spool.directory}.")
+
+@app.on_event("shutdown")
+async def close_clients():
+    await clients.close()
 
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
+def validate_request(req: StartRequest):
+    if req.transfer_mode not in ("file_id", "reupload", "stream", "edit"):
+        raise HTTPException(status_code=400, detail="transfer_mode must be 'file_id', 'reupload', 'stream' or 'edit'")
+    if req.transfer_mode == "edit":
+        if req.source_chat_id != req.dest_chat_id:
+            raise HTTPException(status_code=400, detail="edit mode renames in place, so dest_chat_id must equal source_chat_id")
+        if req.delete_originals:
+            raise HTTPException(status_code=400, detail="delete_originals would delete the renamed messages in edit mode")
+    if req.fallback_mode not in ("reupload", "stream"):
+        raise HTTPException(status_code=400, detail="fallback_mode must be 'reupload' or 'stream'")
+    if not 1 <= req.concurrency <= MAX_CONCURRENCY:
+        raise HTTPException(status_code=400, detail=f"concurrency must be between 1 and {MAX_CONCURRENCY}")
+    if req.max_attempts < 1:
+        raise HTTPException(status_code=400, detail="max_attempts must be at least 1")
+    if req.start_index < 0:
+        raise HTTPException(status_code=400, detail="start_index must not be negative")
+    for field in ("min_message_id", "max_message_id", "offset_id"):
+        if getattr(req, field) is not None and getattr(req, field) < 1:
+            raise HTTPException(status_code=400, detail=f"{field} must be at least 1")
+    if req.min_message_id and req.max_message_id and req.min_message_id > req.max_message_id:
+        raise HTTPException(status_code=400, detail="min_message_id must not be greater than max_message_id")
+
 @app.post("/api/start")
-async def start_task(req: StartRequest, background_tasks: BackgroundTasks):
-    if state.is_running:
-        raise HTTPException(status_code=400, detail="Task is already running")
-    
-    background_tasks.add_task(run_renaming_task, req)
-    return {"message": "Task started", "status": "running"}
+async def start_task(req: StartRequest):
+    validate_request(req)
+
+    job_id = uuid.uuid4().hex
+    JobJournal(job_id).create(req)
+    state = jobs.submit(job_id, req)
+    return {"message": "Task started", "status": state.status, "job_id": job_id}
+
+class PlanEntry:
+    """One row of a dry-run mapping; only turned into a dict while the response is written."""
+    __slots__ = ("index", "message_id", "original_name", "new_name", "bytes", "extension_added", "extension_changed")
+
+    def __init__(self, index: int, media: MediaRecord, new_name: str, requested_name: str):
+        self.index = index
+        self.message_id = media.message_id
+        self.original_name = media.file_name or "unknown.mkv"
+        self.new_name = new_name
+        self.bytes = media.file_size
+        # Which extension rule fired
+        self.extension_added = new_name != requested_name
+        self.extension_changed = (os.path.splitext(self.original_name)[1].lower()
+                                  != os.path.splitext(new_name)[1].lower())
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+@app.post("/api/plan")
+async def plan_task(req: StartRequest):
+    """Dry run: scan the source and map files to names exactly like a job would, without sending anything."""
+    validate_request(req)
+    try:
+        source_chat = int(req.source_chat_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Chat IDs must be integers (e.g., -100123456789).")
+
+    account = account_key(req)
+    if account not in jobs.limiters:
+        jobs.limiters[account] = RateLimiter()
+    limiter = jobs.limiters[account]
+    # Scratch state for the scan's log lines; it is never registered as a job
+    state = TaskState(uuid.uuid4().hex, account, limiter)
+
+    try:
+        client = await clients.acquire(account, req)
+    except Exception as e:
+        # Wrong api_hash, revoked or malformed session string, ...
+        raise HTTPException(status_code=400, detail=f"Could not connect to Telegram: {e}")
+    try:
+        mapping: List[PlanEntry] = []
+        extra_media = 0
+        async for index, media, new_name in iter_mapping(state, client, source_chat, req):
+            if new_name is None:
+                extra_media += 1
+                continue
+            mapping.append(PlanEntry(index, media, new_name, req.filenames[index]))
+    except (RPCError, ValueError) as e:
+        # ChannelPrivate, PeerIdInvalid, ...: the job path logs these as errors
+        raise HTTPException(status_code=400, detail=f"Telegram error while scanning: {e}")
+    finally:
+        clients.release(account)
+
+    name_counts: Dict[str, int] = {}
+    for entry in mapping:
+        name_counts[entry.new_name] = name_counts.get(entry.new_name, 0) + 1
+    duplicates = sorted(name for name, n in name_counts.items() if n > 1)
+
+    total_bytes = sum(entry.bytes for entry in mapping)
+    # Rough estimate: every file costs one rate-limited send, and in the
+    # transfer modes its bytes have to come down and go back up as well.
+    estimated_seconds = len(mapping) / limiter.rate
+    if req.transfer_mode not in ("file_id", "edit"):
+        estimated_seconds += 2 * total_bytes / ESTIMATED_TRANSFER_RATE / req.concurrency
+
+    named = len(req.filenames) - req.start_index
+    summary = {
+        "files": len(mapping),
+        "filenames": len(req.filenames),
+        "unused_filenames": max(0, named - len(mapping)),
+        "extra_media": extra_media,
+        "duplicate_names": duplicates,
+        "extension_added": sum(1 for entry in mapping if entry.extension_added),
+        "extension_changed": sum(1 for entry in mapping if entry.extension_changed),
+        "estimated_bytes": total_bytes,
+        "estimated_seconds": round(estimated_seconds),
+    }
+
+    def body():
+        # Same JSON as before, but the mapping is written a chunk at a time
+        # instead of building every row as a dict up front
+        yield json.dumps(summary)[:-1] + ', "mapping": ['
+        for n in range(0, len(mapping), PLAN_CHUNK):
+            rows = ", ".join(json.dumps(entry.as_dict()) for entry in mapping[n:n + PLAN_CHUNK])
+            yield (", " if n else "") + rows
+        yield "]}"
+
+    return StreamingResponse(body(), media_type="application/json")
+
+def apply_resume_point(req: StartRequest, done: Dict[int, int]):
+    # Jump the scan past the leading run of finished files; finished files
+    # after that point are skipped by message id.
+    index = req.start_index
+    while index in done:
+        index += 1
+    if index > req.start_index:
+        req.offset_id = done[index - 1] + 1
+        req.start_index = index
+
+@app.post("/api/resume")
+async def resume_task(resume: ResumeRequest):
+    if jobs.is_active(resume.job_id):
+        raise HTTPException(status_code=400, detail="Job is already running")
+    journal = JobJournal(resume.job_id)
+    if not JobJournal.valid_id(resume.job_id) or not journal.exists():
+        raise HTTPException(status_code=404, detail="Unknown job id")
+
+    request, done = journal.load()
+    req = StartRequest(
+        api_id=resume.api_id,
+        api_hash=resume.api_hash,
+        session_string=resume.session_string,
+        **request
+    )
+    # Deleted originals drop out of the scan; only the journaled plan
+    # knows which filename each remaining message was given
+    if req.delete_originals and done and not journal.planned():
+        raise HTTPException(status_code=400, detail="This move-mode job has no journaled plan and cannot be resumed safely")
+
+    apply_resume_point(req, done)
+    state = jobs.submit(resume.job_id, req, set(done.values()))
+    return {"message": "Task resumed", "status": state.status, "job_id": resume.job_id, "already_done": len(done)}
 
 @app.post("/api/stop")
-async def stop_task():
-    if not state.is_running:
+async def stop_task(job_id: str):
+    # No fallback to the latest job: on a shared server it may be someone else's
+    state = jobs.get(job_id)
+    if state.status not in ("queued", "running"):
         return {"message": "No task running"}
     state.should_stop = True
+    if state.status == "queued":
+        state.status = "stopped"
+        state.notify()
     return {"message": "Stop signal sent"}
 
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/api/status")
-async def get_status():
+async def get_status(job_id: Optional[str] = None):
+    state = jobs.get(job_id)
+    return {
+        **state.snapshot(),
+        "logs": [data["line"] for _, _, data in state.events.tail(50, "log")], # Return last 50 logs
+        # Continue with /api/logs?after=<log_seq> to get only newer lines
+        "log_seq": state.events.seq
+    }
+
+@app.get("/api/logs")
+async def get_logs(job_id: Optional[str] = None, after: int = 0, limit: int = 500):
+    state = jobs.get(job_id)
+    entries = state.events.after(after, "log", min(max(limit, 1), JOB_EVENT_CAPACITY))
+    return {
+        "logs": [{"seq": seq, "line": data["line"]} for seq, _, data in entries],
+        # Cursor for the next call; if `after` is older than first_seq, lines were overwritten
+        "next": entries[-1][0] if entries else max(after, state.events.seq),
+        "first_seq": state.events.first_seq
+    }
+
+def sse(kind: str, data: dict, seq: Optional[int] = None) -> str:
+    event_id = f"id: {seq}\n" if seq is not None else ""
+    return f"{event_id}event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/api/events")
+async def stream_events(request: Request, job_id: Optional[str] = None, after: int = 0):
+    """Server-Sent Events feed of a job: ``log`` and ``file`` events plus ``progress`` snapshots.
+
+    Every subscriber reads the same per-job event buffer, so extra viewers
+    cost one serialization each instead of extra job work. Reconnecting
+    clients resume with ``?after=<seq>`` or the Last-Event-ID header.
+    """
+    state = jobs.get(job_id)
+    last_event_id = request.headers.get("last-event-id")
+    cursor = int(last_event_id) if last_event_id and last_event_id.isdigit() else after
+
+    async def generate():
+        nonlocal cursor
+        last_snapshot = None
+        while True:
+            # Grab the waiter before reading, so no change slips in between
+            changed = state.changed
+            for seq, kind, data in state.events.after(cursor):
+                yield sse(kind, data, seq)
+                cursor = seq
+            snapshot = state.snapshot()
+            if snapshot != last_snapshot:
+                yield sse("progress", snapshot)
+                last_snapshot = snapshot
+            if state.status not in ("queued", "running"):
+                yield sse("end", {"status": state.status})
+                return
+            if await request.is_disconnected():
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                # Keep proxies from closing an idle connection
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+@app.get("/api/jobs/{job_id}/report")
+async def job_report(job_id: str, format: str = "csv"):
+    """Per-file outcomes of a job, read from its journal, as CSV or JSON lines."""
+    journal = JobJournal(job_id)
+    if not JobJournal.valid_id(job_id) or not journal.exists():
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    if format not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'jsonl'")
+
+    results = journal.results()
+    if format == "jsonl":
+        body = "".join(json.dumps({field: r.get(field) for field in REPORT_FIELDS}) + "\n" for r in results)
+        media_type = "application/x-ndjson"
+    else:
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=REPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+        body = out.getvalue()
+        media_type = "text/csv"
+    return Response(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{job_id}.{format}"'
+    })
+
+@app.get("/api/jobs")
+async def list_jobs():
     return {
-        "is_running": state.is_running,
-        "progress": state.progress,
-        "total": state.total,
-        "current_file": state.current_file,
-        "logs": state.logs[-50:] # Return last 50 logs
+        "running": jobs.running,
+        "max_running": jobs.max_running,
+        "spool_used_bytes": spool.used,
+        "spool_max_bytes": spool.capacity,
+        "jobs": [job.summary() for job in reversed(list(jobs.jobs.values()))]
     }
 
 # SPA & Static Files Serving
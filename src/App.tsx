@@ -9,12 +9,15 @@ export function App() {
   const [sourceChatId, setSourceChatId] = useState('');
   const [destChatId, setDestChatId] = useState('');
   const [newFilenames, setNewFilenames] = useState('');
+  const [transferMode, setTransferMode] = useState('reupload');
   
   const [isRunning, setIsRunning] = useState(false);
   const [logs, setLogs] = useState<string[]>([]);
   const [progress, setProgress] = useState(0);
   const [totalFiles, setTotalFiles] = useState(0);
   const [currentFile, setCurrentFile] = useState('');
+  // Kept across reloads so Stop and the live log stay bound to this browser's job
+  const [jobId, setJobId] = useState<string | null>(() => localStorage.getItem('jobId'));
   
   const [activeTab, setActiveTab] = useState<'config' | 'files' | 'run'>('config');
 
@@ -35,15 +38,18 @@ export function App() {
     }
 
     try {
-      await axios.post('/api/start', {
+      const res = await axios.post('/api/start', {
         api_id: parseInt(apiId),
         api_hash: apiHash,
         session_string: sessionString,
         source_chat_id: sourceChatId,
         dest_chat_id: destChatId,
         filenames: namesList,
-        start_index: 0
+        start_index: 0,
+        transfer_mode: transferMode
       });
+      setJobId(res.data.job_id);
+      localStorage.setItem('jobId', res.data.job_id);
       setIsRunning(true);
       setActiveTab('run');
     } catch (e: any) {
@@ -52,8 +58,9 @@ export function App() {
   };
 
   const stopTask = async () => {
+    if (!jobId) return;
     try {
-      await axios.post('/api/stop');
+      await axios.post('/api/stop', null, { params: { job_id: jobId } });
       alert("Stop signal sent. Task will stop after current file.");
     } catch (e) {
       console.error(e);
@@ -61,26 +68,47 @@ export function App() {
   };
 
   useEffect(() => {
-    let interval: any;
-    if (activeTab === 'run') {
+    if (activeTab !== 'run') return;
+
+    const applyStatus = (data: any) => {
+      setIsRunning(data.is_running);
+      setProgress(data.progress || 0);
+      setTotalFiles(data.total || 0);
+      setCurrentFile(data.current_file || '');
+    };
+
+    // Without a job id (e.g. after a page reload) fall back to polling
+    if (!jobId) {
       const fetchStatus = async () => {
         try {
           const res = await axios.get('/api/status');
-          setIsRunning(res.data.is_running);
+          applyStatus(res.data);
           setLogs(res.data.logs || []);
-          setProgress(res.data.progress || 0);
-          setTotalFiles(res.data.total || 0);
-          setCurrentFile(res.data.current_file || '');
         } catch (e) {
           console.error("Failed to fetch status", e);
         }
       };
-      
+
       fetchStatus();
-      interval = setInterval(fetchStatus, 2000);
+      const interval = setInterval(fetchStatus, 2000);
+      return () => clearInterval(interval);
     }
-    return () => clearInterval(interval);
-  }, [activeTab]);
+
+    // The server pushes progress and log lines as they happen; EventSource
+    // reconnects on its own and resumes from the last event id it saw.
+    setLogs([]);
+    const source = new EventSource(`/api/events?job_id=${jobId}`);
+    source.addEventListener('progress', (e) => applyStatus(JSON.parse((e as MessageEvent).data)));
+    source.addEventListener('log', (e) => {
+      const { line } = JSON.parse((e as MessageEvent).data);
+      setLogs(prev => [...prev, line].slice(-500));
+    });
+    source.addEventListener('end', () => {
+      setIsRunning(false);
+      source.close();
+    });
+    return () => source.close();
+  }, [activeTab, jobId]);
 
   return (
     <div className="min-h-screen bg-slate-50 text-slate-900 font-sans">
@@ -241,6 +269,19 @@ export function App() {
                       className="w-full px-4 py-2.5 rounded-lg border border-slate-300 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 outline-none transition-all"
                     />
                   </div>
+
+                  <div className="col-span-1 md:col-span-2 space-y-2">
+                    <label className="text-sm font-medium text-slate-700">Transfer Mode</label>
+                    <select
+                      value={transferMode}
+                      onChange={(e) => setTransferMode(e.target.value)}
+                      className="w-full px-4 py-2.5 rounded-lg border border-slate-300 focus:ring-2 focus:ring-blue-500 focus:border-blue-500 outline-none transition-all bg-white"
+                    >
+                      <option value="reupload">Re-upload (renames the file)</option>
+                      <option value="stream">Stream (renames the file, no disk)</option>
+                      <option value="file_id">file_id (caption only, keeps the old filename)</option>
+                    </select>
+                  </div>
                 </div>
 
                 <div className="mt-8 flex justify-end">
@@ -298,7 +339,7 @@ export function App() {
                        >
                          <Play size={16} /> Start
                        </button>
-                     ) : (
+                     ) : jobId && (
                        <button 
                          onClick={stopTask}
                          className="bg-red-500 hover:bg-red-600 text-white px-4 py-2 rounded-lg font-medium transition-colors flex items-center gap-2"
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# The backend is a single module in server/, imported as ``main``
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "server"))
+
+# Keep the media index opened at import time out of the real /tmp path
+os.environ.setdefault("MEDIA_INDEX_PATH", os.path.join(tempfile.mkdtemp(), "media_index.sqlite3"))
@@ -0,0 +1,40 @@
+from main import EventLog
+
+
+def seqs(entries):
+    return [entry[0] for entry in entries]
+
+
+def test_empty_log():
+    log = EventLog(4)
+
+    assert log.after(0) == []
+    assert log.tail(3) == []
+
+
+def test_after_and_tail_before_wrap():
+    log = EventLog(4)
+    for n in range(3):
+        log.append("log", {"n": n})
+
+    assert log.first_seq == 1
+    assert seqs(log.after(0)) == [1, 2, 3]
+    assert seqs(log.after(2)) == [3]
+    assert seqs(log.tail(2)) == [2, 3]
+
+
+def test_after_and_tail_after_wrap():
+    log = EventLog(4)
+    # Odd sequence numbers are log lines, even ones progress updates
+    for n in range(10):
+        log.append("log" if n % 2 == 0 else "progress", {"n": n})
+
+    assert log.first_seq == 7
+    # Anything older than the ring is gone
+    assert seqs(log.after(0)) == [7, 8, 9, 10]
+    assert seqs(log.after(8)) == [9, 10]
+    assert seqs(log.after(0, limit=2)) == [7, 8]
+    assert seqs(log.after(7, kind="log")) == [9]
+    assert seqs(log.tail(2)) == [9, 10]
+    assert seqs(log.tail(10, kind="progress")) == [8, 10]
+    assert log.after(6)[0] == (7, "log", {"n": 6})
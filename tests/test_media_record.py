@@ -0,0 +1,57 @@
+from pyrogram import raw, types
+
+from main import MediaRecord
+
+
+def make_document(attributes):
+    return raw.types.Document(
+        id=123, access_hash=456, file_reference=b"ref", date=0, mime_type="video/x-matroska",
+        size=999, dc_id=4, attributes=attributes,
+        thumbs=[raw.types.PhotoStrippedSize(type="i", bytes=b""),
+                raw.types.PhotoSize(type="m", w=320, h=180, size=10)],
+    )
+
+
+def make_message(document):
+    return raw.types.Message(
+        id=7, peer_id=raw.types.PeerChannel(channel_id=1), date=0, message="",
+        media=raw.types.MessageMediaDocument(document=document),
+    )
+
+
+def assert_same(record, parsed):
+    for field in MediaRecord.__slots__:
+        assert getattr(record, field) == getattr(parsed, field), field
+
+
+def test_from_raw_matches_pyrogram_video():
+    video_attribute = raw.types.DocumentAttributeVideo(duration=5, w=320, h=180)
+    document = make_document([video_attribute, raw.types.DocumentAttributeFilename(file_name="a.mkv")])
+    message = types.Message(id=7)
+    message.video = types.Video._parse(None, document, video_attribute, "a.mkv")
+
+    record = MediaRecord.from_raw(make_message(document))
+
+    assert_same(record, MediaRecord.from_message(message))
+    assert record.is_video and record.thumb_file_id is not None
+
+
+def test_from_raw_matches_pyrogram_document():
+    document = make_document([raw.types.DocumentAttributeFilename(file_name="b.zip")])
+    message = types.Message(id=7)
+    message.document = types.Document._parse(None, document, "b.zip")
+
+    record = MediaRecord.from_raw(make_message(document))
+
+    assert_same(record, MediaRecord.from_message(message))
+    assert not record.is_video and record.thumb_file_id is None
+
+
+def test_from_raw_skips_other_media():
+    animation = make_document([raw.types.DocumentAttributeAnimated(),
+                               raw.types.DocumentAttributeVideo(duration=1, w=1, h=1)])
+    audio = make_document([raw.types.DocumentAttributeAudio(duration=1)])
+
+    assert MediaRecord.from_raw(make_message(animation)) is None
+    assert MediaRecord.from_raw(make_message(audio)) is None
+    assert MediaRecord.from_raw(raw.types.MessageEmpty(id=7)) is None
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from pyrogram.errors import ApiIdInvalid, ChannelPrivate
+
+import main
+
+
+def make_request() -> main.StartRequest:
+    return main.StartRequest(
+        api_id=1, api_hash="hash", session_string="session",
+        source_chat_id="-1001", dest_chat_id="-1002", filenames=["a.mkv"],
+    )
+
+
+class FakePool:
+    def __init__(self, error=None):
+        self.error = error
+
+    async def acquire(self, key, req):
+        if self.error:
+            raise self.error
+        return None
+
+    def release(self, key):
+        pass
+
+
+def plan_status(monkeypatch, pool) -> int:
+    monkeypatch.setattr(main, "clients", pool)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.plan_task(make_request()))
+    return error.value.status_code
+
+
+def test_plan_reports_connection_failure(monkeypatch):
+    assert plan_status(monkeypatch, FakePool(ApiIdInvalid())) == 400
+
+
+def test_plan_reports_scan_errors(monkeypatch):
+    async def private_channel(*args, **kwargs):
+        raise ChannelPrivate()
+        yield
+
+    monkeypatch.setattr(main, "iter_media", private_channel)
+
+    assert plan_status(monkeypatch, FakePool()) == 400
@@ -0,0 +1,54 @@
+import asyncio
+
+import main
+
+
+class FakeClient:
+    """Counts how many downloads run at the same time."""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+    async def download_media(self, file_id, file_name):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return file_name
+
+
+def make_item(message_id: int, new_name) -> main.RenameItem:
+    media = main.MediaRecord(message_id, "file", "unique", "orig.mkv", 10, "video/x-matroska", True, None)
+    return main.RenameItem(message_id, media, new_name)
+
+
+def test_failed_prefetch_resolves_and_releases(tmp_path):
+    async def run():
+        state = main.TaskState("c" * 32, "account", main.RateLimiter())
+        prefetcher = main.Prefetcher(state, FakeClient(), str(tmp_path), 100, 2)
+        # download_path raises TypeError for a missing name
+        item = make_item(1, None)
+        prefetcher.add(item)
+        path = await asyncio.wait_for(prefetcher.take(item), timeout=1)
+        await prefetcher.close()
+        return path, prefetcher.budget.used
+
+    assert asyncio.run(run()) == (None, 0)
+
+
+def test_prefetch_downloads_run_concurrently(tmp_path):
+    async def run():
+        state = main.TaskState("c" * 32, "account", main.RateLimiter())
+        client = FakeClient()
+        prefetcher = main.Prefetcher(state, client, str(tmp_path), 1000, 3)
+        items = [make_item(n, f"f{n}.mkv") for n in range(6)]
+        for item in items:
+            prefetcher.add(item)
+        paths = [await asyncio.wait_for(prefetcher.take(item), timeout=1) for item in items]
+        await prefetcher.close()
+        return client.peak, paths
+
+    peak, paths = asyncio.run(run())
+    assert peak == 3
+    assert all(path is not None for path in paths)
@@ -0,0 +1,190 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+JOB_ID = "a" * 32
+
+
+def make_request(**overrides) -> main.StartRequest:
+    fields = dict(
+        api_id=1, api_hash="hash", session_string="session",
+        source_chat_id="-1001", dest_chat_id="-1002",
+        filenames=[f"f{n}.mkv" for n in range(10)],
+    )
+    fields.update(overrides)
+    return main.StartRequest(**fields)
+
+
+def result(index: int, message_id: int, status: str = "ok") -> dict:
+    return {"index": index, "message_id": message_id, "status": status}
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "JOURNAL_DIR", str(tmp_path))
+    return main.JobJournal(JOB_ID)
+
+
+def stub_scan(monkeypatch, message_ids):
+    async def fake_iter_media(state, client, chat_id, min_id=1, max_id=None, use_index=True):
+        for message_id in message_ids:
+            if message_id >= min_id:
+                yield main.MediaRecord(message_id, "file", "unique", f"orig{message_id}.mkv", 1,
+                                       "video/x-matroska", True, None)
+
+    monkeypatch.setattr(main, "iter_media", fake_iter_media)
+
+
+class FakeClient:
+    """Records what a job sends and deletes instead of talking to Telegram."""
+
+    def __init__(self):
+        self.sent = []
+        self.deleted = []
+
+    async def send_cached_media(self, chat_id, file_id, caption):
+        self.sent.append(caption)
+
+    async def delete_messages(self, chat_id, message_ids):
+        self.deleted.extend(message_ids)
+
+
+class FakePool:
+    def __init__(self, client):
+        self.client = client
+
+    async def acquire(self, key, req):
+        return self.client
+
+    def release(self, key):
+        pass
+
+
+def run_mapping(monkeypatch, message_ids, req, planned=None):
+    """``{message_id: new_name}`` from iter_mapping over a stubbed scan of ``message_ids``."""
+    stub_scan(monkeypatch, message_ids)
+
+    async def collect():
+        state = main.TaskState("b" * 32, "account", main.RateLimiter())
+        return {media.message_id: new_name
+                async for index, media, new_name in main.iter_mapping(state, None, -1001, req, planned)}
+
+    return asyncio.run(collect())
+
+
+def test_load_returns_request_and_finished_files(journal):
+    journal.create(make_request())
+    journal.plan(0, 1)
+    journal.record(result(0, 1))
+    journal.record(result(1, 2, "failed"))
+
+    request, done = journal.load()
+
+    assert request["filenames"][0] == "f0.mkv"
+    assert "api_hash" not in request and "session_string" not in request
+    assert done == {0: 1}
+    assert journal.planned() == {1: 0}
+    assert [entry["message_id"] for entry in journal.results()] == [1, 2]
+
+
+def test_load_skips_torn_last_line(journal):
+    journal.create(make_request())
+    journal.record(result(0, 1))
+    with open(journal.path, "a") as f:
+        f.write('{"index": 1, "mess')
+
+    assert journal.load()[1] == {0: 1}
+
+
+def test_resume_point_jumps_past_leading_finished_run():
+    req = make_request(start_index=2)
+    main.apply_resume_point(req, {2: 12, 3: 13, 5: 20})
+
+    assert req.start_index == 4
+    assert req.offset_id == 14
+
+
+def test_resume_point_without_finished_prefix_keeps_request():
+    req = make_request()
+    main.apply_resume_point(req, {1: 5})
+
+    assert req.start_index == 0
+    assert req.offset_id is None
+
+
+def test_resumed_scan_keeps_filenames(monkeypatch):
+    req = make_request()
+    main.apply_resume_point(req, {0: 1, 1: 2})
+
+    mapping = run_mapping(monkeypatch, range(1, 11), req)
+
+    assert mapping == {n: f"f{n - 1}.mkv" for n in range(3, 11)}
+
+
+def test_move_mode_resume_with_gap_keeps_filenames(journal, monkeypatch):
+    # Messages 1-10 all have media; 5 and 6 were renamed and deleted,
+    # 4 failed, and the first run had planned up to message 8
+    req = make_request(delete_originals=True)
+    journal.create(req)
+    for message_id in range(1, 9):
+        journal.plan(message_id - 1, message_id)
+    journal.record(result(4, 5))
+    journal.record(result(5, 6))
+    journal.record(result(3, 4, "failed"))
+
+    _, done = journal.load()
+    main.apply_resume_point(req, done)
+    mapping = run_mapping(monkeypatch, [1, 2, 3, 4, 7, 8, 9, 10], req, journal.planned())
+
+    assert mapping == {1: "f0.mkv", 2: "f1.mkv", 3: "f2.mkv", 4: "f3.mkv",
+                       7: "f6.mkv", 8: "f7.mkv", 9: "f8.mkv", 10: "f9.mkv"}
+
+
+def test_move_mode_resume_skips_media_before_start_index(monkeypatch):
+    req = make_request(start_index=2, delete_originals=True)
+
+    mapping = run_mapping(monkeypatch, [1, 2, 4, 5, 6], req, {4: 2, 5: 3})
+
+    assert mapping == {4: "f2.mkv", 5: "f3.mkv", 6: "f4.mkv"}
+
+
+def test_move_mode_resume_stops_after_last_filename(journal, monkeypatch):
+    # Messages 1 and 3 were renamed and deleted, 2 failed; message 4 came
+    # after the last planned one and has no filename
+    req = make_request(filenames=["a.mkv", "b.mkv", "c.mkv"], transfer_mode="file_id", delete_originals=True)
+    journal.create(req)
+    for message_id in (1, 2, 3):
+        journal.plan(message_id - 1, message_id)
+    journal.record(result(0, 1))
+    journal.record(result(2, 3))
+    journal.record(result(1, 2, "failed"))
+
+    _, done = journal.load()
+    main.apply_resume_point(req, done)
+    stub_scan(monkeypatch, [2, 4])
+    client = FakeClient()
+    monkeypatch.setattr(main, "clients", FakePool(client))
+
+    async def run():
+        state = main.TaskState(JOB_ID, "account", main.RateLimiter())
+        await asyncio.wait_for(main.run_renaming_task(state, req, set(done.values())), timeout=5)
+        return state
+
+    state = asyncio.run(run())
+
+    assert state.status == "completed"
+    assert client.sent == ["b.mkv"]
+    assert client.deleted == [2]
+
+
+def test_resume_refuses_move_mode_job_without_plan(journal):
+    journal.create(make_request(delete_originals=True))
+    journal.record(result(0, 1))
+
+    resume = main.ResumeRequest(job_id=JOB_ID, api_id=1, api_hash="hash", session_string="session")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.resume_task(resume))
+    assert error.value.status_code == 400
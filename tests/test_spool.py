@@ -0,0 +1,16 @@
+import os
+
+import main
+
+
+def test_sweep_removes_only_download_directories(tmp_path):
+    (tmp_path / "0123abcd-42").mkdir()
+    (tmp_path / "0123abcd-42" / "file.mkv").write_bytes(b"partial")
+    (tmp_path / "journals").mkdir()
+    (tmp_path / "journals" / "job.jsonl").write_text("{}\n")
+    (tmp_path / "media_index.sqlite3").write_bytes(b"")
+
+    removed = main.DownloadSpool(str(tmp_path), 1000).sweep()
+
+    assert removed == 1
+    assert sorted(os.listdir(tmp_path)) == ["journals", "media_index.sqlite3"]